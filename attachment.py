@@ -0,0 +1,194 @@
+import io
+import csv
+import codecs
+import mmap
+import hashlib
+import shutil
+import tempfile
+import threading
+from collections import Counter
+from functools import cached_property
+
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+SNIFF_BYTES = 64 * 1024
+SNIFF_DELIMITERS = ",;\t|"
+SNIFF_LINES = 50
+DECODE_CHUNK_BYTES = 1024 * 1024
+DECODE_ENCODINGS = ["utf-8", "cp1252"]
+
+BOMS = [
+    (b"\xef\xbb\xbf", "utf-8-sig"),
+    (b"\xff\xfe", "utf-16"),
+    (b"\xfe\xff", "utf-16"),
+]
+
+
+class _ViewReader(io.RawIOBase):
+    def __init__(self, view: memoryview):
+        self._view = view
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self._view) - self._pos))
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+class Attachment:
+    # One buffer per job: small files stay in memory, large ones are spooled to disk
+    # and mmap'd. Encoding, delimiter and header row are detected once and cached;
+    # the decoded text itself is not, see read_text().
+    # Every holder that outlives the request (scheduler, trainer thread) calls
+    # retain() and close(); the buffer is released when the last one closes.
+
+    def __init__(self, data, filename: str, spool=None):
+        self.filename = filename
+        self._buffer = data
+        self._spool = spool
+        self._refs = 1
+        self._refs_lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, fileobj, filename: str) -> "Attachment":
+        fileobj.seek(0)
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        shutil.copyfileobj(fileobj, spool)
+        size = spool.tell()
+        if size <= SPOOL_MAX_BYTES:
+            spool.seek(0)
+            data = spool.read()
+            spool.close()
+            return cls(data, filename)
+        spool.flush()
+        return cls(mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ), filename, spool=spool)
+
+    def retain(self) -> "Attachment":
+        with self._refs_lock:
+            self._refs += 1
+        return self
+
+    def close(self):
+        with self._refs_lock:
+            self._refs -= 1
+            if self._refs > 0 or self._spool is None:
+                return
+            spool, self._spool = self._spool, None
+        try:
+            self._buffer.close()
+        except BufferError:
+            # A stream still exports the mmap; it is unmapped once that is collected
+            pass
+        spool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def size(self) -> int:
+        return len(self._buffer)
+
+    def bytes_view(self) -> memoryview:
+        return memoryview(self._buffer)
+
+    def binary_stream(self) -> io.BufferedReader:
+        return io.BufferedReader(_ViewReader(self.bytes_view()))
+
+    def text_stream(self) -> io.TextIOWrapper:
+        return io.TextIOWrapper(self.binary_stream(), encoding=self.encoding, newline="")
+
+    @cached_property
+    def content_hash(self) -> str:
+        return hashlib.sha256(self.bytes_view()).hexdigest()
+
+    @cached_property
+    def encoding(self) -> str:
+        head = bytes(self._buffer[:4])
+        for bom, encoding in BOMS:
+            if head.startswith(bom):
+                return encoding
+
+        # Validate chunk by chunk so detection never materialises the whole text
+        view = self.bytes_view()
+        for encoding in DECODE_ENCODINGS:
+            decoder = codecs.getincrementaldecoder(encoding)()
+            try:
+                for start in range(0, len(view), DECODE_CHUNK_BYTES):
+                    decoder.decode(view[start:start + DECODE_CHUNK_BYTES])
+                decoder.decode(b"", final=True)
+                return encoding
+            except UnicodeDecodeError:
+                continue
+        # latin-1 maps every byte, so it always decodes
+        return "latin-1"
+
+    def read_text(self) -> str:
+        # Not cached: a long-lived holder (e.g. the trainer thread) would otherwise
+        # pin a full str copy of a large spooled file.
+        return str(self.bytes_view(), self.encoding, errors="replace")
+
+    def peek_text(self, max_bytes: int = SNIFF_BYTES) -> str:
+        if self.size <= max_bytes:
+            return self.read_text()
+        chunk = bytes(self._buffer[:max_bytes]).decode(self.encoding, errors="ignore")
+        cut = chunk.rfind("\n")
+        return chunk[:cut + 1] if cut > 0 else chunk
+
+    def _sample_lines(self) -> list:
+        return self.peek_text().splitlines()[:SNIFF_LINES]
+
+    @cached_property
+    def delimiter(self) -> str:
+        # Pick the delimiter that most lines split on consistently; csv.Sniffer is
+        # thrown off by the title/preamble lines many ad-server exports start with.
+        lines = self._sample_lines()
+        best, best_score = ",", (0, 0)
+        for delimiter in SNIFF_DELIMITERS:
+            widths = Counter(len(row) for row in csv.reader(lines, delimiter=delimiter))
+            widths.pop(1, None)
+            widths.pop(0, None)
+            if not widths:
+                continue
+            width, freq = widths.most_common(1)[0]
+            if (freq, width) > best_score:
+                best, best_score = delimiter, (freq, width)
+        return best
+
+    @cached_property
+    def header_row(self) -> int:
+        # First line with the most common field count, so report preambles are skipped
+        lines = self._sample_lines()
+        counts = [len(row) for row in csv.reader(lines, delimiter=self.delimiter)]
+        widths = Counter(c for c in counts if c >= 2)
+        if not widths:
+            return 0
+        modal = widths.most_common(1)[0][0]
+        return counts.index(modal)
+
+    @cached_property
+    def columns(self) -> list:
+        lines = self._sample_lines()
+        if self.header_row >= len(lines):
+            return []
+        row = next(csv.reader([lines[self.header_row]], delimiter=self.delimiter), [])
+        return [col.strip() for col in row]
@@ -4,6 +4,7 @@ import pandas as pd
 import requests
 import threading
 from parser import parse_with_gpt
+from attachment import Attachment
 from main_parser import get_parser_output, save_to_unhandled
 from load_parsers import load_all_parsers
 from parser_trainer import handle_unprocessed_files
@@ -11,10 +12,10 @@ from parser_trainer import handle_unprocessed_files
 MAILGUN_DOMAIN = os.getenv("MAILGUN_DOMAIN")
 MAILGUN_API_KEY = os.getenv("MAILGUN_API_KEY")
 
-def process_email_attachment(raw_bytes: bytes, filename: str):
+def match_known_parser(attachment: Attachment):
     try:
         print("[process_email_attachment] Attempting parser match...")
-        raw_text = raw_bytes.decode("utf-8", errors="ignore")
+        raw_text = attachment.read_text()
         parsers = load_all_parsers()
 
         for name, parser_func in parsers.items():
@@ -34,23 +35,29 @@ def process_email_attachment(raw_bytes: bytes, filename: str):
 
     except Exception as parser_err:
         print(f"[process_email_attachment] No parser matched: {parser_err}")
-        try:
-            raw_text = raw_bytes.decode("utf-8", errors="ignore")
-            parsed_csv = parse_with_gpt(raw_text)
-            df = pd.read_csv(io.StringIO(parsed_csv))
-            df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True, errors='coerce')
-            df.dropna(subset=['timestamp'], inplace=True)
-
-            save_to_unhandled(filename, raw_bytes)
-            threading.Thread(target=handle_unprocessed_files, daemon=True).start()
-
-            print("[process_email_attachment] Fallback to GPT succeeded.")
-            return df, "gpt", None
-
-        except Exception as gpt_err:
-            print(f"[process_email_attachment] GPT fallback failed: {gpt_err}")
-            save_to_unhandled(filename, raw_bytes)
-            raise RuntimeError("No parser found and GPT fallback failed.")
+        return None
+
+def _save_unhandled_and_train(attachment: Attachment, sender, job_id):
+    if save_to_unhandled(attachment, sender=sender, job_id=job_id):
+        preloaded = {attachment.content_hash: attachment.retain()}
+        threading.Thread(target=handle_unprocessed_files, kwargs={"preloaded": preloaded}, daemon=True).start()
+
+def parse_with_gpt_fallback(attachment: Attachment, sender=None, job_id=None):
+    try:
+        parsed_csv = parse_with_gpt(attachment.read_text())
+        df = pd.read_csv(io.StringIO(parsed_csv))
+        df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True, errors='coerce')
+        df.dropna(subset=['timestamp'], inplace=True)
+
+        _save_unhandled_and_train(attachment, sender, job_id)
+
+        print("[process_email_attachment] Fallback to GPT succeeded.")
+        return df, "gpt", None
+
+    except Exception as gpt_err:
+        print(f"[process_email_attachment] GPT fallback failed: {gpt_err}")
+        _save_unhandled_and_train(attachment, sender, job_id)
+        raise RuntimeError("No parser found and GPT fallback failed.")
 
 def send_report(to_email: str, report_bytes: bytes, filename: str):
     if not MAILGUN_DOMAIN or not MAILGUN_API_KEY:
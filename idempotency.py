@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import boto3
+from abc import ABC, abstractmethod
+
+S3_BUCKET = os.getenv("S3_BUCKET_NAME")
+IDEMPOTENCY_PREFIX = "idempotency/"
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", 24 * 60 * 60))
+# An in-flight claim lapses sooner so a crashed worker doesn't swallow the retries.
+# The request handler refreshes it every CLAIM_REFRESH_SECONDS while the job is
+# queued or running, so it only expires once the owning process is gone.
+PROCESSING_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_PROCESSING_TTL_SECONDS", 30 * 60))
+CLAIM_REFRESH_SECONDS = PROCESSING_TTL_SECONDS // 3
+
+s3_client = boto3.client(
+    "s3",
+    region_name=os.getenv("AWS_REGION", "us-east-2"),
+    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+)
+
+def idempotency_key(message_id: str, content_hash: str) -> str:
+    norm = message_id.strip().strip("<>")
+    return hashlib.sha256(f"{norm}:{content_hash}".encode("utf-8")).hexdigest()
+
+class IdempotencyStore(ABC):
+    # Records are {"job_id", "status", "expires_at", "response"}; status moves from
+    # "processing" to "completed"/"failed" and the final response is replayed to
+    # any retry that arrives before the record expires.
+
+    def __init__(self, ttl_seconds: int = IDEMPOTENCY_TTL_SECONDS, processing_ttl_seconds: int = PROCESSING_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.processing_ttl_seconds = processing_ttl_seconds
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def _get(self, key):
+        pass
+
+    @abstractmethod
+    def _put(self, key, record):
+        pass
+
+    @abstractmethod
+    def _delete(self, key):
+        pass
+
+    def get(self, key):
+        record = self._get(key)
+        if record and record["expires_at"] < time.time():
+            return None
+        return record
+
+    # Returns (record, True) for a new request, or (existing record, False) for a retry.
+    # The lock only serialises claims within this process; Mailgun retries are
+    # minutes apart, so a get-then-put is enough for the S3 store.
+    def claim(self, key, job_id):
+        with self._lock:
+            existing = self.get(key)
+            if existing:
+                return existing, False
+            record = {
+                "job_id": job_id,
+                "status": "processing",
+                "expires_at": time.time() + self.processing_ttl_seconds,
+                "response": None,
+            }
+            self._put(key, record)
+            return record, True
+
+    # Extends an in-flight claim still owned by job_id; a no-op once it has finished.
+    def refresh(self, key, job_id):
+        with self._lock:
+            record = self.get(key)
+            if not record or record["job_id"] != job_id or record["status"] != "processing":
+                return
+            record["expires_at"] = time.time() + self.processing_ttl_seconds
+            self._put(key, record)
+
+    def finish(self, key, job_id, status, status_code, body):
+        with self._lock:
+            self._put(key, {
+                "job_id": job_id,
+                "status": status,
+                "expires_at": time.time() + self.ttl_seconds,
+                "response": {"status_code": status_code, "body": body},
+            })
+
+    # Drops an in-flight claim so the next retry is processed from scratch.
+    def release(self, key):
+        with self._lock:
+            self._delete(key)
+
+class LocalIdempotencyStore(IdempotencyStore):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._records = {}
+
+    def _get(self, key):
+        return self._records.get(key)
+
+    def _put(self, key, record):
+        now = time.time()
+        self._records = {k: r for k, r in self._records.items() if r["expires_at"] >= now}
+        self._records[key] = record
+
+    def _delete(self, key):
+        self._records.pop(key, None)
+
+class S3IdempotencyStore(IdempotencyStore):
+    # Expired objects are ignored on read; pair the prefix with an S3 lifecycle
+    # rule to have them deleted.
+
+    def _get(self, key):
+        try:
+            obj = s3_client.get_object(Bucket=S3_BUCKET, Key=f"{IDEMPOTENCY_PREFIX}{key}.json")
+            return json.loads(obj["Body"].read().decode("utf-8"))
+        except s3_client.exceptions.NoSuchKey:
+            return None
+
+    def _put(self, key, record):
+        s3_client.put_object(
+            Bucket=S3_BUCKET,
+            Key=f"{IDEMPOTENCY_PREFIX}{key}.json",
+            Body=json.dumps(record).encode("utf-8")
+        )
+
+    def _delete(self, key):
+        s3_client.delete_object(Bucket=S3_BUCKET, Key=f"{IDEMPOTENCY_PREFIX}{key}.json")
+
+def get_idempotency_store() -> IdempotencyStore:
+    backend = os.getenv("IDEMPOTENCY_STORE", "s3" if S3_BUCKET else "local")
+    if backend == "s3":
+        return S3IdempotencyStore()
+    return LocalIdempotencyStore()
@@ -1,12 +1,20 @@
 import os
 import json
+import threading
 import boto3
 from datetime import datetime
+from job_stats import record_job_created, record_job_updated
 
 S3_BUCKET = os.getenv("S3_BUCKET_NAME")
 JOB_LOG_KEY = "job_logs/jobs.json"
 EVENT_LOG_PREFIX = "event_logs/"
 
+# jobs.json and the daily event log are rewritten whole on every change; these
+# serialise the read-modify-write across request threads, scheduler workers and
+# trainer threads.
+job_log_lock = threading.Lock()
+event_log_lock = threading.Lock()
+
 s3_client = boto3.client(
     "s3",
     region_name=os.getenv("AWS_REGION", "us-east-2"),
@@ -43,61 +51,77 @@ def log_event(event_type, job_id=None, details=None):
         "details": details or {}
     }
     log_key = f"{EVENT_LOG_PREFIX}{now[:10]}.jsonl"
-    try:
-        existing = ""
+    with event_log_lock:
         try:
-            obj = s3_client.get_object(Bucket=S3_BUCKET, Key=log_key)
-            existing = obj["Body"].read().decode("utf-8")
-        except s3_client.exceptions.NoSuchKey:
-            pass
-        existing += json.dumps(event) + "\n"
-        s3_client.put_object(Bucket=S3_BUCKET, Key=log_key, Body=existing.encode("utf-8"))
-    except Exception as e:
-        print(f"[event_logger] Failed to log event: {e}")
+            existing = ""
+            try:
+                obj = s3_client.get_object(Bucket=S3_BUCKET, Key=log_key)
+                existing = obj["Body"].read().decode("utf-8")
+            except s3_client.exceptions.NoSuchKey:
+                pass
+            existing += json.dumps(event) + "\n"
+            s3_client.put_object(Bucket=S3_BUCKET, Key=log_key, Body=existing.encode("utf-8"))
+        except Exception as e:
+            print(f"[event_logger] Failed to log event: {e}")
 
 def log_job(job_id, sender, subject, filename):
-    jobs = _load_job_log()
-    now = datetime.utcnow().isoformat()
-    jobs.append({
-        "job_id": job_id,
-        "sender": sender,
-        "subject": subject,
-        "filename": filename,
-        "status": "processing",
-        "created_at": now,
-        "updated_at": now,
-        "last_rebuild": None,
-        "error": None,
-        "parsed_by": None,
-        "parser_name": None,
-        "duration_seconds": None
-    })
-    _save_job_log(jobs)
+    with job_log_lock:
+        jobs = _load_job_log()
+        now = datetime.utcnow().isoformat()
+        job = {
+            "job_id": job_id,
+            "sender": sender,
+            "subject": subject,
+            "filename": filename,
+            "status": "processing",
+            "created_at": now,
+            "updated_at": now,
+            "last_rebuild": None,
+            "error": None,
+            "parsed_by": None,
+            "parser_name": None,
+            "duration_seconds": None
+        }
+        jobs.append(job)
+        _save_job_log(jobs)
+    try:
+        record_job_created(job)
+    except Exception as e:
+        print(f"[job_logger] Failed to update job stats: {e}")
     log_event("job_created", job_id=job_id, details={"sender": sender, "filename": filename})
 
 def update_job_status(job_id, status, error_message=None, rebuilt=False, parsed_by=None, parser_name=None):
-    jobs = _load_job_log()
-    now = datetime.utcnow().isoformat()
-    for job in jobs:
-        if job["job_id"] == job_id:
-            job["status"] = status
-            job["updated_at"] = now
-            if error_message:
-                job["error"] = error_message
-            if rebuilt:
-                job["last_rebuild"] = now
-            if parsed_by:
-                job["parsed_by"] = parsed_by
-            if parser_name:
-                job["parser_name"] = parser_name
-            if status == "completed" and job.get("created_at"):
-                try:
-                    start = datetime.fromisoformat(job["created_at"])
-                    job["duration_seconds"] = round((datetime.utcnow() - start).total_seconds(), 2)
-                except Exception:
-                    job["duration_seconds"] = None
-            break
-    _save_job_log(jobs)
+    with job_log_lock:
+        jobs = _load_job_log()
+        now = datetime.utcnow().isoformat()
+        before = after = None
+        for job in jobs:
+            if job["job_id"] == job_id:
+                before = dict(job)
+                after = job
+                job["status"] = status
+                job["updated_at"] = now
+                if error_message:
+                    job["error"] = error_message
+                if rebuilt:
+                    job["last_rebuild"] = now
+                if parsed_by:
+                    job["parsed_by"] = parsed_by
+                if parser_name:
+                    job["parser_name"] = parser_name
+                if status == "completed" and job.get("created_at"):
+                    try:
+                        start = datetime.fromisoformat(job["created_at"])
+                        job["duration_seconds"] = round((datetime.utcnow() - start).total_seconds(), 2)
+                    except Exception:
+                        job["duration_seconds"] = None
+                break
+        _save_job_log(jobs)
+    if after is not None:
+        try:
+            record_job_updated(before, after)
+        except Exception as e:
+            print(f"[job_logger] Failed to update job stats: {e}")
     log_event("job_status_updated", job_id=job_id, details={
         "status": status,
         "error_message": error_message,
@@ -106,6 +130,22 @@ def update_job_status(job_id, status, error_message=None, rebuilt=False, parsed_
         "rebuilt": rebuilt
     })
 
+def mark_job_rebuilt(job_id):
+    # A parser was trained from this job's file; status and duration are left
+    # alone so failed jobs stay failed and rollups don't see a new completion.
+    with job_log_lock:
+        jobs = _load_job_log()
+        now = datetime.utcnow().isoformat()
+        for job in jobs:
+            if job["job_id"] == job_id:
+                job["last_rebuild"] = now
+                job["updated_at"] = now
+                break
+        else:
+            return
+        _save_job_log(jobs)
+    log_event("job_rebuilt", job_id=job_id)
+
 def get_all_jobs():
     jobs = _load_job_log()
     jobs.sort(key=lambda j: j.get("updated_at", ""), reverse=True)
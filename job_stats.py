@@ -0,0 +1,174 @@
+import os
+import json
+import math
+import threading
+import boto3
+from datetime import datetime, timedelta
+
+S3_BUCKET = os.getenv("S3_BUCKET_NAME")
+JOB_STATS_KEY = "job_logs/stats.json"
+STATS_RETENTION_DAYS = 400
+
+# Log-bucketed duration histogram (HDR/DDSketch style): every quantile it
+# reports is within SKETCH_RELATIVE_ACCURACY of the true value.
+SKETCH_RELATIVE_ACCURACY = 0.01
+SKETCH_GAMMA = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+SKETCH_MIN_VALUE = 0.01
+PERCENTILES = [50, 90, 95, 99]
+
+# Guards read-modify-write of stats.json between the request path and trainer threads.
+job_stats_lock = threading.Lock()
+
+s3_client = boto3.client(
+    "s3",
+    region_name=os.getenv("AWS_REGION", "us-east-2"),
+    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+)
+
+def _load_stats():
+    try:
+        obj = s3_client.get_object(Bucket=S3_BUCKET, Key=JOB_STATS_KEY)
+        return json.loads(obj["Body"].read().decode("utf-8"))
+    except s3_client.exceptions.NoSuchKey:
+        return {"days": {}}
+
+def _save_stats(stats):
+    cutoff = (datetime.utcnow() - timedelta(days=STATS_RETENTION_DAYS)).date().isoformat()
+    stats["days"] = {day: bucket for day, bucket in stats["days"].items() if day >= cutoff}
+    try:
+        s3_client.put_object(
+            Bucket=S3_BUCKET,
+            Key=JOB_STATS_KEY,
+            Body=json.dumps(stats).encode("utf-8")
+        )
+    except Exception as e:
+        print(f"[job_stats] Failed to save job stats: {e}")
+
+def _new_sketch():
+    return {"count": 0, "sum": 0.0, "min": None, "max": None, "buckets": {}}
+
+def _sketch_add(sketch, value):
+    value = max(float(value), SKETCH_MIN_VALUE)
+    key = str(math.ceil(math.log(value, SKETCH_GAMMA)))
+    sketch["buckets"][key] = sketch["buckets"].get(key, 0) + 1
+    sketch["count"] += 1
+    sketch["sum"] += value
+    sketch["min"] = value if sketch["min"] is None else min(sketch["min"], value)
+    sketch["max"] = value if sketch["max"] is None else max(sketch["max"], value)
+
+def _sketch_merge(into, sketch):
+    for key, count in sketch["buckets"].items():
+        into["buckets"][key] = into["buckets"].get(key, 0) + count
+    into["count"] += sketch["count"]
+    into["sum"] += sketch["sum"]
+    for bound, pick in (("min", min), ("max", max)):
+        if sketch[bound] is not None:
+            into[bound] = sketch[bound] if into[bound] is None else pick(into[bound], sketch[bound])
+
+def _sketch_quantile(sketch, q):
+    rank = q * (sketch["count"] - 1)
+    seen = 0
+    for key in sorted(sketch["buckets"], key=int):
+        seen += sketch["buckets"][key]
+        if seen > rank:
+            value = 2 * SKETCH_GAMMA ** int(key) / (SKETCH_GAMMA + 1)
+            return round(min(max(value, sketch["min"]), sketch["max"]), 2)
+    return sketch["max"]
+
+def _summarize_sketch(sketch):
+    if not sketch["count"]:
+        return {"count": 0}
+    summary = {
+        "count": sketch["count"],
+        "mean": round(sketch["sum"] / sketch["count"], 2),
+        "min": sketch["min"],
+        "max": sketch["max"],
+    }
+    for p in PERCENTILES:
+        summary[f"p{p}"] = _sketch_quantile(sketch, p / 100)
+    return summary
+
+def _day_bucket(stats, created_at):
+    day = (created_at or datetime.utcnow().isoformat())[:10]
+    return stats["days"].setdefault(day, {
+        "jobs": 0,
+        "status": {},
+        "parsed_by": {},
+        "parser_name": {},
+        "duration": {"all": _new_sketch(), "parsed_by": {}, "parser_name": {}},
+    })
+
+def _bump(counts, key, delta=1):
+    counts[key] = counts.get(key, 0) + delta
+    if counts[key] <= 0:
+        del counts[key]
+
+def record_job_created(job):
+    with job_stats_lock:
+        stats = _load_stats()
+        bucket = _day_bucket(stats, job.get("created_at"))
+        bucket["jobs"] += 1
+        _bump(bucket["status"], job["status"])
+        _save_stats(stats)
+
+def record_job_updated(before, after):
+    with job_stats_lock:
+        stats = _load_stats()
+        bucket = _day_bucket(stats, after.get("created_at"))
+
+        if before.get("status") != after["status"]:
+            if before.get("status"):
+                _bump(bucket["status"], before["status"], -1)
+            _bump(bucket["status"], after["status"])
+        for field in ("parsed_by", "parser_name"):
+            if after.get(field) and after[field] != before.get(field):
+                if before.get(field):
+                    _bump(bucket[field], before[field], -1)
+                _bump(bucket[field], after[field])
+
+        # Only the first completion counts towards durations
+        duration = after.get("duration_seconds")
+        if duration is not None and before.get("duration_seconds") is None:
+            sketches = bucket["duration"]
+            _sketch_add(sketches["all"], duration)
+            for field in ("parsed_by", "parser_name"):
+                if after.get(field):
+                    _sketch_add(sketches[field].setdefault(after[field], _new_sketch()), duration)
+
+        _save_stats(stats)
+
+def get_job_stats(days=7):
+    stats = _load_stats()
+    start = (datetime.utcnow() - timedelta(days=days - 1)).date().isoformat()
+
+    jobs = 0
+    counts = {"status": {}, "parsed_by": {}, "parser_name": {}}
+    durations = {"all": _new_sketch(), "parsed_by": {}, "parser_name": {}}
+    for day, bucket in stats["days"].items():
+        if day < start:
+            continue
+        jobs += bucket["jobs"]
+        for field in counts:
+            for key, count in bucket[field].items():
+                _bump(counts[field], key, count)
+        _sketch_merge(durations["all"], bucket["duration"]["all"])
+        for field in ("parsed_by", "parser_name"):
+            for key, sketch in bucket["duration"][field].items():
+                _sketch_merge(durations[field].setdefault(key, _new_sketch()), sketch)
+
+    routed = sum(counts["parsed_by"].values())
+    return {
+        "window_days": days,
+        "since": start,
+        "jobs": jobs,
+        "status": counts["status"],
+        "parsed_by": counts["parsed_by"],
+        "parsed_by_share": {k: round(v / routed, 4) for k, v in counts["parsed_by"].items()} if routed else {},
+        "parser_name": counts["parser_name"],
+        "duration_seconds": {
+            "all": _summarize_sketch(durations["all"]),
+            "parsed_by": {k: _summarize_sketch(s) for k, s in durations["parsed_by"].items()},
+            "parser_name": {k: _summarize_sketch(s) for k, s in durations["parser_name"].items()},
+        },
+    }
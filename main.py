@@ -1,8 +1,14 @@
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse, HTMLResponse
-from emailer import process_email_attachment, send_report, send_error_report
-from job_logger import log_job, update_job_status, get_all_jobs
+from fastapi.concurrency import run_in_threadpool
+from emailer import send_report, send_error_report
+from scheduler import InboundScheduler, AdmissionRejected
+from attachment import Attachment
+from job_logger import log_job, update_job_status, get_all_jobs, log_event
+from job_stats import get_job_stats, STATS_RETENTION_DAYS
+from idempotency import get_idempotency_store, idempotency_key, CLAIM_REFRESH_SECONDS
 import uuid
+import asyncio
 import traceback
 import requests
 from datetime import datetime, timedelta
@@ -11,6 +17,25 @@ import os
 import json
 
 app = FastAPI()
+idempotency_store = get_idempotency_store()
+IN_FLIGHT_RETRY_AFTER_SECONDS = 300
+scheduler = InboundScheduler()
+
+def _finish_idempotent(idem_key, job_id, status, status_code, body):
+    if not idem_key:
+        return
+    try:
+        idempotency_store.finish(idem_key, job_id, status, status_code, body)
+    except Exception as e:
+        print(f"[email_inbound] Failed to record idempotent result for {job_id}: {e}")
+
+async def _keep_claim_alive(idem_key, job_id):
+    while True:
+        await asyncio.sleep(CLAIM_REFRESH_SECONDS)
+        try:
+            await run_in_threadpool(idempotency_store.refresh, idem_key, job_id)
+        except Exception as e:
+            print(f"[email_inbound] Failed to refresh idempotency claim for {job_id}: {e}")
 
 @app.get("/")
 def read_root():
@@ -35,6 +60,19 @@ def list_jobs(status: str = None, parsed_by: str = None):
     html += "</table>"
     return HTMLResponse(content=html)
 
+@app.get("/jobs/stats")
+def job_stats(days: int = 7):
+    if not 1 <= days <= STATS_RETENTION_DAYS:
+        return JSONResponse({"error": f"days must be between 1 and {STATS_RETENTION_DAYS}"}, status_code=400)
+    try:
+        return get_job_stats(days)
+    except Exception as e:
+        return JSONResponse({"error": f"Failed to load job stats: {e}"}, status_code=500)
+
+@app.get("/scheduler/stats")
+def scheduler_stats():
+    return scheduler.stats()
+
 @app.get("/events")
 def list_events(event_type: str = None, job_id: str = None):
     s3 = boto3.client(
@@ -79,7 +117,12 @@ def list_events(event_type: str = None, job_id: str = None):
 
 @app.post("/email-inbound")
 async def email_inbound(request: Request):
+    # Disk, S3 and Mailgun calls run in the threadpool and parsing runs in the
+    # scheduler, so the event loop only awaits.
     job_id = str(uuid.uuid4())
+    idem_key = None
+    keepalive = None
+    attachment = None
     try:
         form = await request.form()
         sender = form.get("sender", "unknown").strip()
@@ -88,28 +131,70 @@ async def email_inbound(request: Request):
 
         if attachment_count == 0:
             reason = "No attachment provided."
-            send_error_report(sender, "unknown", subject, reason)
+            await run_in_threadpool(send_error_report, sender, "unknown", subject, reason)
             return JSONResponse({"error": reason}, status_code=400)
 
         file_key = "attachment-1"
         upload = form.get(file_key)
         filename = upload.filename if hasattr(upload, "filename") else "unknown"
-        file_bytes = await upload.read()
 
         if filename.lower().endswith(".pdf"):
             reason = "PDF files are not supported."
-            send_error_report(sender, filename, subject, reason)
+            await run_in_threadpool(send_error_report, sender, filename, subject, reason)
             return JSONResponse({"error": reason}, status_code=400)
 
-        log_job(job_id, sender, subject, filename)
-        print(f"[email_inbound] Processing job {job_id} from {sender} - {filename}")
+        attachment = await run_in_threadpool(Attachment.from_file, upload.file, filename)
+
+        # Mailgun retries the webhook when we are slow; replay instead of reprocessing.
+        message_id = form.get("Message-Id") or form.get("message-id")
+        if message_id:
+            key = idempotency_key(message_id, attachment.content_hash)
+            try:
+                record, is_new = await run_in_threadpool(idempotency_store.claim, key, job_id)
+            except Exception as e:
+                print(f"[email_inbound] Idempotency check failed, processing anyway: {e}")
+                record, is_new = None, True
+            if not is_new:
+                await run_in_threadpool(log_event, "duplicate_inbound", job_id=record["job_id"], details={
+                    "message_id": message_id,
+                    "status": record["status"]
+                })
+                if record["response"]:
+                    response = record["response"]
+                    return JSONResponse(response["body"], status_code=response["status_code"])
+                # Non-2xx keeps Mailgun retrying, so the message survives if the
+                # original worker dies before finishing.
+                return JSONResponse(
+                    {"message": "Already processing.", "job_id": record["job_id"]},
+                    status_code=409,
+                    headers={"Retry-After": str(IN_FLIGHT_RETRY_AFTER_SECONDS)},
+                )
+            if record:
+                idem_key = key
+                keepalive = asyncio.create_task(_keep_claim_alive(key, job_id))
 
-        df, parsed_by, parser_name = process_email_attachment(file_bytes, filename)
-        output_csv = df.to_csv(index=False).encode("utf-8")
-        send_report(sender, output_csv, f"SpotIQ_Report_{filename}")
-        update_job_status(job_id, "completed", parsed_by=parsed_by, parser_name=parser_name)
+        future = scheduler.submit(attachment, sender, job_id)
+        await run_in_threadpool(log_job, job_id, sender, subject, filename)
+        print(f"[email_inbound] Queued job {job_id} from {sender} - {filename}")
 
-        return JSONResponse({"message": f"Report sent to {sender}."})
+        df, parsed_by, parser_name = await asyncio.wrap_future(future)
+        output_csv = await run_in_threadpool(lambda: df.to_csv(index=False).encode("utf-8"))
+        await run_in_threadpool(send_report, sender, output_csv, f"SpotIQ_Report_{filename}")
+        await run_in_threadpool(update_job_status, job_id, "completed", parsed_by=parsed_by, parser_name=parser_name)
+
+        body = {"message": f"Report sent to {sender}.", "job_id": job_id}
+        await run_in_threadpool(_finish_idempotent, idem_key, job_id, "completed", 200, body)
+        return JSONResponse(body)
+
+    except AdmissionRejected as e:
+        # Not a job failure: answer 503 so Mailgun retries once the queue drains.
+        if idem_key:
+            try:
+                await run_in_threadpool(idempotency_store.release, idem_key)
+            except Exception as release_err:
+                print(f"[email_inbound] Failed to release idempotency claim: {release_err}")
+        await run_in_threadpool(log_event, "inbound_rejected", details={"sender": sender, "filename": filename, "reason": str(e)})
+        return JSONResponse({"error": str(e)}, status_code=503)
 
     except Exception as e:
         error_msg = str(e)
@@ -117,9 +202,19 @@ async def email_inbound(request: Request):
         sender = sender if "sender" in locals() else "unknown"
         subject = subject if "subject" in locals() else "Unknown"
         filename = filename if "filename" in locals() else "unknown"
-        update_job_status(job_id, "failed", error_message=error_msg)
-        send_error_report(sender, filename, subject, error_msg)
-        return JSONResponse({"error": error_msg}, status_code=500)
+        await run_in_threadpool(update_job_status, job_id, "failed", error_message=error_msg)
+        await run_in_threadpool(send_error_report, sender, filename, subject, error_msg)
+        body = {"error": error_msg, "job_id": job_id}
+        # The sender already has the error report; retries replay 406 so Mailgun
+        # stops instead of hammering a cached failure.
+        await run_in_threadpool(_finish_idempotent, idem_key, job_id, "failed", 406, body)
+        return JSONResponse(body, status_code=500)
+
+    finally:
+        if keepalive is not None:
+            keepalive.cancel()
+        if attachment is not None:
+            attachment.close()
 
 @app.get("/match-program")
 def match_program(title: str):
@@ -1,14 +1,24 @@
 import os
 import hashlib
 import pandas as pd
-from s3_utils import upload_unhandled_log
+from datetime import datetime
+from s3_utils import (
+    upload_unhandled_log,
+    move_s3_object,
+    load_unhandled_manifest,
+    save_unhandled_manifest,
+    unhandled_manifest_lock,
+)
 
 PARSERS_DIR = "parsers"
 
-def fingerprint_csv(df) -> str:
-    norm = ",".join(sorted(col.strip().lower() for col in df.columns))
+def fingerprint_columns(columns) -> str:
+    norm = ",".join(sorted(str(col).strip().lower() for col in columns))
     return hashlib.md5(norm.encode("utf-8")).hexdigest()
 
+def fingerprint_csv(df) -> str:
+    return fingerprint_columns(df.columns)
+
 def save_parser_to_repo(fingerprint: str, parser_code: str) -> str:
     if not os.path.exists(PARSERS_DIR):
         os.makedirs(PARSERS_DIR)
@@ -21,21 +31,97 @@ def save_parser_to_repo(fingerprint: str, parser_code: str) -> str:
 
     return filepath
 
-def save_to_unhandled(filename: str, content: bytes):
+def unhandled_name(attachment) -> str:
+    ext = os.path.splitext(attachment.filename)[1].lower() or ".csv"
+    return f"{attachment.content_hash}{ext}"
+
+# Unhandled logs are stored once per content hash; resends only append upload
+# metadata. Returns True only for a header layout not seen before, i.e. when the
+# caller should kick off parser training.
+def save_to_unhandled(attachment, sender=None, job_id=None) -> bool:
     unhandled_dir = "unhandled_logs"
     os.makedirs(unhandled_dir, exist_ok=True)
 
-    filepath = os.path.join(unhandled_dir, filename)
-    with open(filepath, "wb") as f:
-        f.write(content)
+    name = unhandled_name(attachment)
+    filepath = os.path.join(unhandled_dir, name)
+    if not os.path.exists(filepath):
+        with open(filepath, "wb") as f:
+            f.write(attachment.bytes_view())
+        print(f"[↪] Saved unhandled log to {filepath}")
+
+    upload = {
+        "sender": sender,
+        "job_id": job_id,
+        "filename": attachment.filename,
+        "received_at": datetime.utcnow().isoformat(),
+    }
 
-    print(f"[↪] Saved unhandled log to {filepath}")
-    
-    # Also upload to S3
     try:
-        upload_unhandled_log(filename, content)
+        with unhandled_manifest_lock:
+            if _record_duplicate_upload(attachment.content_hash, upload):
+                print(f"[↪] Duplicate unhandled log {name}; recorded upload only")
+                return False
+
+        # Upload outside the lock so concurrent GPT workers don't queue behind S3
+        upload_unhandled_log(name, attachment.binary_stream())
+
+        # Files without a usable header each get their own layout, so they are
+        # not all lumped together behind whichever one arrived first.
+        if len(attachment.columns) >= 2:
+            layout_id = fingerprint_columns(attachment.columns)
+        else:
+            layout_id = f"unparsed-{attachment.content_hash}"
+
+        with unhandled_manifest_lock:
+            if _record_duplicate_upload(attachment.content_hash, upload):
+                return False
+            manifest = load_unhandled_manifest()
+            layout = manifest["layouts"].get(layout_id)
+            is_new_layout = layout is None
+            if is_new_layout:
+                layout = manifest["layouts"][layout_id] = {
+                    "columns": attachment.columns,
+                    "status": "queued",
+                    "parser": None,
+                    "samples": [],
+                }
+            layout["samples"].append(attachment.content_hash)
+            manifest["samples"][attachment.content_hash] = {
+                "key": f"unhandled_logs/{name}",
+                "layout": layout_id,
+                "size": attachment.size,
+                "uploads": [upload],
+            }
+            save_unhandled_manifest(manifest)
+            covered_by = layout["parser"] if layout["status"] == "trained" else None
+
+        # The layout already has a parser, so nothing will train on this sample;
+        # file it as handled now rather than leaving it in unhandled_logs/.
+        if covered_by:
+            handled_key = f"handled_logs/{name}"
+            move_s3_object(f"unhandled_logs/{name}", handled_key)
+            with unhandled_manifest_lock:
+                manifest = load_unhandled_manifest()
+                sample = manifest["samples"][attachment.content_hash]
+                sample["key"] = handled_key
+                sample["covered_by"] = covered_by
+                save_unhandled_manifest(manifest)
+            print(f"[↪] {name} matches layout already covered by {covered_by}; filed as handled")
+
+        return is_new_layout
     except Exception as e:
-        print(f"[✖] Failed to upload unhandled log to S3: {e}")
+        print(f"[✖] Failed to record unhandled log in S3: {e}")
+        return False
+
+def _record_duplicate_upload(content_hash, upload) -> bool:
+    # Caller holds unhandled_manifest_lock
+    manifest = load_unhandled_manifest()
+    sample = manifest["samples"].get(content_hash)
+    if not sample:
+        return False
+    sample["uploads"].append(upload)
+    save_unhandled_manifest(manifest)
+    return True
 
 def get_parser_output(parser_func, raw_text: str) -> pd.DataFrame:
     df = parser_func(raw_text)
@@ -2,18 +2,23 @@ import os
 import openai
 import pandas as pd
 import hashlib
+from attachment import Attachment
 from main_parser import get_parser_output, save_to_unhandled
-from parsers_registry import compute_fingerprint
-from s3_utils import upload_parser_module
-from job_logger import update_job_status
+from s3_utils import (
+    upload_parser_module,
+    move_s3_object,
+    load_unhandled_manifest,
+    save_unhandled_manifest,
+    unhandled_manifest_lock,
+)
+from job_logger import mark_job_rebuilt
 import boto3
-from io import BytesIO
-import re
 
 AWS_REGION = os.getenv("AWS_REGION", "us-east-2")
 S3_BUCKET = os.getenv("S3_BUCKET_NAME")
 UNHANDLED_PREFIX = "unhandled_logs/"
 HANDLED_PREFIX = "handled_logs/"
+SAMPLE_ROWS = 100
 
 PARSERS_DIR = "parsers"
 FAILED_DIR = "failed_parsers"
@@ -65,39 +70,100 @@ Only return valid Python code. No markdown. No explanation. No comments.
 
     return code
 
-def move_s3_object(old_key, new_key):
-    s3_client.copy_object(Bucket=S3_BUCKET, CopySource={'Bucket': S3_BUCKET, 'Key': old_key}, Key=new_key)
-    s3_client.delete_object(Bucket=S3_BUCKET, Key=old_key)
-
-def sanitize_filename(name: str) -> str:
-    name = name.strip()
-    name = re.sub(r"[^\w\-.()]", "_", name)
-    name = name.replace("..", "_")
-    return name
-
-def handle_unprocessed_files():
-    response = s3_client.list_objects_v2(Bucket=S3_BUCKET, Prefix=UNHANDLED_PREFIX)
-    if "Contents" not in response:
-        print("[trainer] No unhandled logs in S3.")
+def _claim_layouts(statuses):
+    with unhandled_manifest_lock:
+        manifest = load_unhandled_manifest()
+        claimed = []
+        for layout_id, layout in manifest["layouts"].items():
+            if layout["status"] not in statuses or not layout["samples"]:
+                continue
+            sample_hash = layout["samples"][0]
+            layout["status"] = "training"
+            claimed.append((layout_id, sample_hash, manifest["samples"][sample_hash]))
+        if claimed:
+            save_unhandled_manifest(manifest)
+        return claimed
+
+def _finish_layout(layout_id, status, parser_filename=None):
+    # Returns the job_ids of every upload sharing this layout once it is trained.
+    # S3 moves happen outside the lock so inbound jobs aren't held up by them.
+    with unhandled_manifest_lock:
+        manifest = load_unhandled_manifest()
+        layout = manifest["layouts"][layout_id]
+        layout["status"] = status
+        layout["parser"] = parser_filename
+        save_unhandled_manifest(manifest)
+        if status != "trained":
+            return []
+        pending = {
+            sample_hash: manifest["samples"][sample_hash]["key"]
+            for sample_hash in layout["samples"]
+            if manifest["samples"][sample_hash]["key"].startswith(UNHANDLED_PREFIX)
+        }
+
+    moved = {}
+    for sample_hash, key in pending.items():
+        new_key = HANDLED_PREFIX + key[len(UNHANDLED_PREFIX):]
+        try:
+            move_s3_object(key, new_key)
+            moved[sample_hash] = new_key
+        except Exception as e:
+            print(f"[trainer] Failed to move {key} to handled: {e}")
+
+    with unhandled_manifest_lock:
+        manifest = load_unhandled_manifest()
+        job_ids = []
+        for sample_hash in manifest["layouts"][layout_id]["samples"]:
+            sample = manifest["samples"][sample_hash]
+            if sample_hash in moved:
+                sample["key"] = moved[sample_hash]
+            job_ids += [u["job_id"] for u in sample["uploads"] if u.get("job_id")]
+        save_unhandled_manifest(manifest)
+        return job_ids
+
+def handle_unprocessed_files(preloaded=None, statuses=("queued",)):
+    # Trains at most one parser per header layout in the unhandled manifest.
+    # preloaded maps content hashes to Attachments already buffered by the
+    # inbound job, so their bytes and format analysis are reused; they are
+    # closed once training finishes.
+    preloaded = preloaded or {}
+    try:
+        _train_claimed_layouts(preloaded, statuses)
+    finally:
+        for attachment in preloaded.values():
+            attachment.close()
+
+def _train_claimed_layouts(preloaded, statuses):
+    claimed = _claim_layouts(statuses)
+    if not claimed:
+        print("[trainer] No unhandled layouts awaiting training.")
         return
 
-    for obj in response["Contents"]:
-        key = obj["Key"]
-        if not key.lower().endswith(".csv") or key == UNHANDLED_PREFIX:
-            continue
-
-        filename = key.split("/")[-1]
-        safe_filename = sanitize_filename(filename)
-        print(f"[trainer] Handling {filename}")
+    for layout_id, sample_hash, sample in claimed:
+        key = sample["key"]
+        filename = sample["uploads"][0]["filename"]
+        print(f"[trainer] Handling layout {layout_id} from {filename}")
 
         try:
-            file_obj = s3_client.get_object(Bucket=S3_BUCKET, Key=key)
-            raw_bytes = file_obj["Body"].read()
-            raw_text = raw_bytes.decode("utf-8", errors="ignore")
+            if not filename.lower().endswith(".csv"):
+                print(f"[trainer] Skipped {filename} - not a CSV.")
+                _finish_layout(layout_id, "skipped")
+                continue
 
-            df = pd.read_csv(BytesIO(raw_bytes))
+            attachment = preloaded.get(sample_hash)
+            if attachment is None:
+                file_obj = s3_client.get_object(Bucket=S3_BUCKET, Key=key)
+                attachment = Attachment(file_obj["Body"].read(), filename)
+
+            df = pd.read_csv(
+                attachment.text_stream(),
+                sep=attachment.delimiter,
+                skiprows=attachment.header_row,
+                nrows=SAMPLE_ROWS,
+            )
             if df.empty or df.shape[1] < 2:
                 print(f"[trainer] Skipped {filename} - empty or invalid structure.")
+                _finish_layout(layout_id, "skipped")
                 continue
 
             columns = list(df.columns)
@@ -107,13 +173,14 @@ def handle_unprocessed_files():
                 compile(parser_code, "<generated_parser>", "exec")
             except SyntaxError as e:
                 print(f"[trainer] Invalid parser skipped: {e}")
-                fingerprint = compute_fingerprint(raw_text)
+                fingerprint = attachment.content_hash
                 fail_path = os.path.join(FAILED_DIR, f"{fingerprint}.py")
                 with open(fail_path, "w") as f:
                     f.write(parser_code)
+                _finish_layout(layout_id, "failed")
                 continue
 
-            fingerprint = compute_fingerprint(raw_text)
+            fingerprint = attachment.content_hash
             parser_filename = f"{fingerprint}.py"
             parser_path = os.path.join(PARSERS_DIR, parser_filename)
 
@@ -123,19 +190,9 @@ def handle_unprocessed_files():
             with open(parser_path, "rb") as f:
                 upload_parser_module(parser_filename, f.read())
 
-            new_key = f"{HANDLED_PREFIX}{safe_filename}"
-            move_s3_object(key, new_key)
-
-            # Attempt to extract job_id from filename if named like job_<id>_something.csv
-            job_id = None
-            if safe_filename.startswith("job_") and "_" in safe_filename:
-                parts = safe_filename.split("_")
-                if len(parts) > 1:
-                    job_id = parts[1]
-
-            if job_id:
+            for job_id in _finish_layout(layout_id, "trained", parser_filename):
                 try:
-                    update_job_status(job_id, "completed", rebuilt=True)
+                    mark_job_rebuilt(job_id)
                 except Exception as e:
                     print(f"[trainer] Failed to mark job {job_id} as rebuilt: {e}")
 
@@ -143,6 +200,10 @@ def handle_unprocessed_files():
 
         except Exception as e:
             print(f"[trainer] ERROR handling {filename}: {e}")
+            try:
+                _finish_layout(layout_id, "failed")
+            except Exception as finish_err:
+                print(f"[trainer] Failed to mark layout {layout_id} as failed: {finish_err}")
 
 if __name__ == "__main__":
-    handle_unprocessed_files()
+    handle_unprocessed_files(statuses=("queued", "failed"))
@@ -2,9 +2,16 @@
 
 import boto3
 import os
+import json
+import threading
 
 AWS_REGION = os.getenv("AWS_REGION", "us-east-2")
 S3_BUCKET = os.getenv("S3_BUCKET_NAME")
+UNHANDLED_MANIFEST_KEY = "unhandled_logs/manifest.json"
+
+# Guards read-modify-write of the unhandled manifest between the request
+# handler and the background trainer thread.
+unhandled_manifest_lock = threading.Lock()
 
 aws_access_key = os.getenv("AWS_ACCESS_KEY_ID")
 aws_secret_key = os.getenv("AWS_SECRET_ACCESS_KEY")
@@ -23,7 +30,7 @@ except Exception as e:
     print(f"[S3_UTILS] Failed to initialize S3 client: {e}")
     raise
 
-def upload_unhandled_log(filename: str, content: bytes) -> str:
+def upload_unhandled_log(filename: str, content) -> str:
     key = f"unhandled_logs/{filename}"
     try:
         s3_client.put_object(Bucket=S3_BUCKET, Key=key, Body=content)
@@ -42,3 +49,25 @@ def upload_parser_module(filename: str, content: bytes) -> str:
     except Exception as e:
         print(f"[S3_UTILS] Failed to upload parser module: {e}")
         raise
+
+def move_s3_object(old_key: str, new_key: str):
+    s3_client.copy_object(Bucket=S3_BUCKET, CopySource={'Bucket': S3_BUCKET, 'Key': old_key}, Key=new_key)
+    s3_client.delete_object(Bucket=S3_BUCKET, Key=old_key)
+
+def load_unhandled_manifest() -> dict:
+    try:
+        obj = s3_client.get_object(Bucket=S3_BUCKET, Key=UNHANDLED_MANIFEST_KEY)
+        return json.loads(obj["Body"].read().decode("utf-8"))
+    except s3_client.exceptions.NoSuchKey:
+        return {"samples": {}, "layouts": {}}
+
+def save_unhandled_manifest(manifest: dict):
+    try:
+        s3_client.put_object(
+            Bucket=S3_BUCKET,
+            Key=UNHANDLED_MANIFEST_KEY,
+            Body=json.dumps(manifest, indent=2).encode("utf-8")
+        )
+    except Exception as e:
+        print(f"[S3_UTILS] Failed to save unhandled manifest: {e}")
+        raise
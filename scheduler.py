@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+from emailer import match_known_parser, parse_with_gpt_fallback
+
+PARSER_WORKERS = int(os.getenv("SCHEDULER_PARSER_WORKERS", 4))
+GPT_WORKERS = int(os.getenv("SCHEDULER_GPT_WORKERS", 2))
+# Admission limits count jobs anywhere in the system: queued or running in
+# either pool, until their result is delivered.
+MAX_QUEUE_DEPTH = int(os.getenv("SCHEDULER_MAX_QUEUE_DEPTH", 200))
+MAX_SENDER_QUEUE_DEPTH = int(os.getenv("SCHEDULER_MAX_SENDER_QUEUE_DEPTH", 20))
+# {"agency@example.com": 2.0, ...}; senders not listed get weight 1
+SENDER_WEIGHTS = {
+    sender.strip().lower(): float(weight)
+    for sender, weight in json.loads(os.getenv("SCHEDULER_SENDER_WEIGHTS", "{}")).items()
+}
+_bad_weights = {sender: weight for sender, weight in SENDER_WEIGHTS.items() if not weight > 0}
+if _bad_weights:
+    raise ValueError(f"SCHEDULER_SENDER_WEIGHTS must all be positive: {_bad_weights}")
+# A job's cost is 1 plus one unit per COST_BYTES_UNIT of attachment, so a sender
+# sending huge files uses up its share faster than one sending small files.
+COST_BYTES_UNIT = 1024 * 1024
+WAIT_SAMPLES = 1000
+
+class AdmissionRejected(Exception):
+    pass
+
+class FairPool:
+    # Worker pool with one FIFO per sender, dequeued by start-time fair queuing:
+    # the sender with the lowest virtual time goes next, and each job advances
+    # its sender's virtual time by cost / weight.
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self._cond = threading.Condition()
+        self._queues = {}
+        self._vtime = {}
+        self._system_vtime = 0.0
+        self._depth = 0
+        self._running = 0
+        self._threads = []
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self._counts = {"submitted": 0, "completed": 0, "failed": 0}
+
+    def submit(self, sender, cost, fn, future):
+        with self._cond:
+            queue = self._queues.get(sender)
+            if not queue:
+                queue = self._queues[sender] = deque()
+                self._vtime[sender] = max(self._vtime.get(sender, 0.0), self._system_vtime)
+            queue.append((cost, fn, future, time.monotonic()))
+            self._depth += 1
+            self._counts["submitted"] += 1
+            self._ensure_workers()
+            self._cond.notify()
+
+    def _ensure_workers(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"{self.name}-{len(self._threads)}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def _next(self):
+        sender = min((s for s, q in self._queues.items() if q), key=lambda s: self._vtime[s])
+        cost, fn, future, enqueued_at = self._queues[sender].popleft()
+        if not self._queues[sender]:
+            del self._queues[sender]
+        self._system_vtime = self._vtime[sender]
+        self._vtime[sender] += cost / SENDER_WEIGHTS.get(sender, 1.0)
+        self._depth -= 1
+        # An idle sender at or behind system time would be reset to it on its
+        # next submit anyway, so its entry can go.
+        for idle in [s for s, v in self._vtime.items() if s not in self._queues and v <= self._system_vtime]:
+            del self._vtime[idle]
+        return fn, future, enqueued_at
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._depth:
+                    self._cond.wait()
+                fn, future, enqueued_at = self._next()
+                self._waits.append(time.monotonic() - enqueued_at)
+                self._running += 1
+            try:
+                fn(future)
+                ok = True
+            except Exception as e:
+                ok = False
+                if not future.done():
+                    future.set_exception(e)
+            with self._cond:
+                self._running -= 1
+                self._counts["completed" if ok else "failed"] += 1
+
+    def stats(self):
+        with self._cond:
+            waits = sorted(self._waits)
+            depths = {s: len(q) for s, q in self._queues.items()}
+            summary = {
+                "workers": self.workers,
+                "running": self._running,
+                "queued": self._depth,
+                "queued_by_sender": depths,
+                **self._counts,
+            }
+        if waits:
+            summary["queue_wait_seconds"] = {
+                f"p{p}": round(waits[min(len(waits) - 1, int(p / 100 * len(waits)))], 3)
+                for p in (50, 95, 99)
+            }
+            summary["queue_wait_seconds"]["max"] = round(waits[-1], 3)
+        return summary
+
+class InboundScheduler:
+    # Every attachment first runs in the cheap parser pool; only those no known
+    # parser matches move on to the GPT pool, which has its own, smaller
+    # capacity. Admission control counts a job from submit until its future
+    # resolves, so work waiting on the GPT pool still counts against the limits.
+
+    def __init__(self, parser_workers=PARSER_WORKERS, gpt_workers=GPT_WORKERS,
+                 max_depth=MAX_QUEUE_DEPTH, max_sender_depth=MAX_SENDER_QUEUE_DEPTH):
+        self.parser_pool = FairPool("parser", parser_workers)
+        self.gpt_pool = FairPool("gpt", gpt_workers)
+        self.max_depth = max_depth
+        self.max_sender_depth = max_sender_depth
+        self._lock = threading.Lock()
+        self._in_system = {}
+        self._total = 0
+        self._rejected = 0
+
+    def _admit(self, sender_key):
+        with self._lock:
+            if self._total >= self.max_depth or self._in_system.get(sender_key, 0) >= self.max_sender_depth:
+                self._rejected += 1
+                raise AdmissionRejected("Inbound queue is full; try again later.")
+            self._in_system[sender_key] = self._in_system.get(sender_key, 0) + 1
+            self._total += 1
+
+    def _release(self, sender_key):
+        with self._lock:
+            self._total -= 1
+            self._in_system[sender_key] -= 1
+            if not self._in_system[sender_key]:
+                del self._in_system[sender_key]
+
+    def submit(self, attachment, sender, job_id) -> Future:
+        sender_key = (sender or "unknown").strip().lower()
+        cost = 1 + attachment.size / COST_BYTES_UNIT
+        future = Future()
+
+        def run_gpt(future):
+            future.set_result(parse_with_gpt_fallback(attachment, sender=sender, job_id=job_id))
+
+        def run_parser(future):
+            result = match_known_parser(attachment)
+            if result is not None:
+                future.set_result(result)
+            else:
+                self.gpt_pool.submit(sender_key, cost, run_gpt, future)
+
+        def on_done(_):
+            self._release(sender_key)
+            attachment.close()
+
+        self._admit(sender_key)
+        attachment.retain()
+        future.add_done_callback(on_done)
+        self.parser_pool.submit(sender_key, cost, run_parser, future)
+        return future
+
+    def stats(self):
+        with self._lock:
+            admission = {
+                "in_system": self._total,
+                "in_system_by_sender": dict(self._in_system),
+                "max_depth": self.max_depth,
+                "max_sender_depth": self.max_sender_depth,
+                "rejected": self._rejected,
+            }
+        return {"admission": admission, "parser": self.parser_pool.stats(), "gpt": self.gpt_pool.stats()}